@@ -5,17 +5,23 @@ A super simple FastAPI application that allows students to view and sign up
 for extracurricular activities at Mergington High School.
 """
 
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from pydantic import BaseModel, EmailStr
+from sqlalchemy import select, func, delete
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import selectinload, load_only
+from pydantic import BaseModel, ConfigDict, EmailStr, TypeAdapter
 import os
 from pathlib import Path
 from contextlib import asynccontextmanager
 
-from database import init_db, get_session, seed_initial_data, Activity, Participant
+import cache
+from database import (
+    init_db, get_session, get_write_session, seed_initial_data, Activity,
+    Participant
+)
 
 
 # Pydantic models for request/response
@@ -32,13 +38,50 @@ class ActivityUpdate(BaseModel):
     max_participants: int | None = None
 
 
+class ActivityResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    name: str
+    description: str
+    schedule: str
+    max_participants: int
+
+
+class ActivityChangeResponse(BaseModel):
+    message: str
+    activity: ActivityResponse
+
+
+class ActivityDetails(BaseModel):
+    description: str
+    schedule: str
+    max_participants: int
+    participants: list[str]
+
+
+# Serialises the activities listing straight to JSON bytes (pydantic-core)
+activities_adapter = TypeAdapter(dict[str, ActivityDetails])
+
+
+class CachedStaticFiles(StaticFiles):
+    """Static files that browsers may reuse for an hour without revalidating"""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        # Starlette already answers If-None-Match / If-Modified-Since with 304
+        response.headers["Cache-Control"] = "public, max-age=3600"
+        return response
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Initialize database
+    # Startup: Initialize database and cache
     await init_db()
     await seed_initial_data()
+    await cache.init_cache()
     yield
-    # Shutdown: Clean up resources if needed
+    # Shutdown: Clean up resources
+    await cache.close_cache()
 
 
 app = FastAPI(
@@ -49,7 +92,7 @@ app = FastAPI(
 
 # Mount the static files directory
 current_dir = Path(__file__).parent
-app.mount("/static", StaticFiles(directory=os.path.join(Path(__file__).parent,
+app.mount("/static", CachedStaticFiles(directory=os.path.join(Path(__file__).parent,
           "static")), name="static")
 
 
@@ -58,68 +101,111 @@ def root():
     return RedirectResponse(url="/static/index.html")
 
 
-@app.get("/activities")
+@app.get("/activities", response_model=dict[str, ActivityDetails])
 async def get_activities(session: AsyncSession = Depends(get_session)):
     """Get all activities with their participants"""
-    result = await session.execute(select(Activity))
+    cached = await cache.get_activities()
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    generation = await cache.get_generation()
+    
+    # Eager-load participants in one extra query instead of one per activity,
+    # fetching only their emails
+    try:
+        result = await session.execute(
+            select(Activity).options(
+                selectinload(Activity.participants).load_only(Participant.email)
+            )
+        )
+    except SQLAlchemyError:
+        # Fall back to the last known listing if the database is unavailable
+        stale = await cache.get_stale_activities()
+        if stale is None:
+            raise
+        return Response(
+            content=stale,
+            media_type="application/json",
+            headers={"X-Cache-Stale": "true"}
+        )
     activities = result.scalars().all()
     
     # Format response to match the original structure
     activities_dict = {}
     for activity in activities:
-        activities_dict[activity.name] = {
-            "description": activity.description,
-            "schedule": activity.schedule,
-            "max_participants": activity.max_participants,
-            "participants": [p.email for p in activity.participants]
-        }
+        activities_dict[activity.name] = ActivityDetails(
+            description=activity.description,
+            schedule=activity.schedule,
+            max_participants=activity.max_participants,
+            participants=[p.email for p in activity.participants]
+        )
     
-    return activities_dict
+    # Encode once; the same bytes are cached and sent
+    payload = activities_adapter.dump_json(activities_dict)
+    await cache.set_activities(payload, generation)
+    return Response(content=payload, media_type="application/json")
 
 
 @app.post("/activities/{activity_name}/signup")
 async def signup_for_activity(
     activity_name: str, 
     email: str,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_write_session)
 ):
     """Sign up a student for an activity"""
-    # Find the activity
+    # Find the activity, whether the student is already signed up and the
+    # current participant count in a single round trip
+    participant_count = (
+        select(func.count(Participant.id))
+        .where(Participant.activity_id == Activity.id)
+        .correlate(Activity)
+        .scalar_subquery()
+    )
     result = await session.execute(
-        select(Activity).where(Activity.name == activity_name)
+        select(
+            Activity.id,
+            Activity.max_participants,
+            Participant.id.label("participant_id"),
+            participant_count.label("participant_count")
+        )
+        .select_from(Activity)
+        .outerjoin(
+            Participant,
+            (Participant.activity_id == Activity.id) & (Participant.email == email)
+        )
+        .where(Activity.name == activity_name)
     )
-    activity = result.scalar_one_or_none()
+    activity = result.one_or_none()
     
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
     
     # Check if student is already signed up
-    result = await session.execute(
-        select(Participant).where(
-            Participant.activity_id == activity.id,
-            Participant.email == email
-        )
-    )
-    existing = result.scalar_one_or_none()
-    
-    if existing:
+    if activity.participant_id is not None:
         raise HTTPException(
             status_code=400,
             detail="Student is already signed up"
         )
     
     # Check if activity is full
-    participant_count = len(activity.participants)
-    if participant_count >= activity.max_participants:
+    if activity.participant_count >= activity.max_participants:
         raise HTTPException(
             status_code=400,
             detail="Activity is full"
         )
     
-    # Add student
+    # Add student (the unique constraint catches a concurrent duplicate
+    # signup that the check above could not see)
     new_participant = Participant(email=email, activity_id=activity.id)
     session.add(new_participant)
-    await session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(
+            status_code=400,
+            detail="Student is already signed up"
+        )
+    await cache.invalidate_activities()
     
     return {"message": f"Signed up {email} for {activity_name}"}
 
@@ -128,46 +214,46 @@ async def signup_for_activity(
 async def unregister_from_activity(
     activity_name: str,
     email: str,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_write_session)
 ):
     """Unregister a student from an activity"""
-    # Find the activity
+    # Find the activity and the participant in a single round trip
     result = await session.execute(
-        select(Activity).where(Activity.name == activity_name)
+        select(Activity.id, Participant.id.label("participant_id"))
+        .select_from(Activity)
+        .outerjoin(
+            Participant,
+            (Participant.activity_id == Activity.id) & (Participant.email == email)
+        )
+        .where(Activity.name == activity_name)
     )
-    activity = result.scalar_one_or_none()
+    activity = result.one_or_none()
     
     if not activity:
         raise HTTPException(status_code=404, detail="Activity not found")
     
-    # Find the participant
-    result = await session.execute(
-        select(Participant).where(
-            Participant.activity_id == activity.id,
-            Participant.email == email
-        )
-    )
-    participant = result.scalar_one_or_none()
-    
-    if not participant:
+    if activity.participant_id is None:
         raise HTTPException(
             status_code=400,
             detail="Student is not signed up for this activity"
         )
     
     # Remove student
-    await session.delete(participant)
+    await session.execute(
+        delete(Participant).where(Participant.id == activity.participant_id)
+    )
     await session.commit()
+    await cache.invalidate_activities()
     
     return {"message": f"Unregistered {email} from {activity_name}"}
 
 
 # Admin endpoints for CRUD operations
 
-@app.post("/admin/activities")
+@app.post("/admin/activities", response_model=ActivityChangeResponse)
 async def create_activity(
     activity: ActivityCreate,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_write_session)
 ):
     """Create a new activity (Admin only)"""
     # Check if activity already exists
@@ -191,24 +277,22 @@ async def create_activity(
     )
     session.add(new_activity)
     await session.commit()
-    await session.refresh(new_activity)
+    await cache.invalidate_activities()
     
     return {
         "message": "Activity created successfully",
-        "activity": {
-            "name": new_activity.name,
-            "description": new_activity.description,
-            "schedule": new_activity.schedule,
-            "max_participants": new_activity.max_participants
-        }
+        "activity": new_activity
     }
 
 
-@app.put("/admin/activities/{activity_name}")
+@app.put(
+    "/admin/activities/{activity_name}",
+    response_model=ActivityChangeResponse
+)
 async def update_activity(
     activity_name: str,
     activity_update: ActivityUpdate,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_write_session)
 ):
     """Update an existing activity (Admin only)"""
     # Find the activity
@@ -229,23 +313,18 @@ async def update_activity(
         activity.max_participants = activity_update.max_participants
     
     await session.commit()
-    await session.refresh(activity)
+    await cache.invalidate_activities()
     
     return {
         "message": "Activity updated successfully",
-        "activity": {
-            "name": activity.name,
-            "description": activity.description,
-            "schedule": activity.schedule,
-            "max_participants": activity.max_participants
-        }
+        "activity": activity
     }
 
 
 @app.delete("/admin/activities/{activity_name}")
 async def delete_activity(
     activity_name: str,
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_write_session)
 ):
     """Delete an activity (Admin only)"""
     # Find the activity
@@ -260,6 +339,7 @@ async def delete_activity(
     # Delete the activity (participants will be cascade deleted)
     await session.delete(activity)
     await session.commit()
+    await cache.invalidate_activities()
     
     return {"message": f"Activity '{activity_name}' deleted successfully"}
 
@@ -0,0 +1,143 @@
+"""
+Response cache for the High School Management System
+
+The activities listing is read far more often than it changes, so its
+encoded JSON is cached in Redis when REDIS_URL is set. A copy of the last
+payload is also kept in process so it can still be served (marked as
+stale) when Redis or the database is unavailable.
+"""
+
+import os
+import time
+
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+
+# Redis connection - caching is skipped when this is not configured
+REDIS_URL = os.getenv("REDIS_URL")
+
+ACTIVITIES_KEY = "activities:v1"
+STALE_ACTIVITIES_KEY = "activities:v1:stale"
+GENERATION_KEY = "activities:v1:generation"
+
+# How long a cached listing is served as fresh, and how long the stale
+# copy is kept around as a fallback
+ACTIVITIES_TTL = int(os.getenv("ACTIVITIES_CACHE_TTL", "15"))
+STALE_ACTIVITIES_TTL = int(os.getenv("ACTIVITIES_STALE_TTL", "3600"))
+
+client = None
+
+# Last payload seen by this process: (stored_at, payload)
+_last_activities = None
+
+# Bumped on every invalidation so that a listing built from data read
+# before a change is not stored after it
+_generation = 0
+
+
+async def init_cache():
+    """Create the Redis client if a Redis URL is configured"""
+    global client
+    if REDIS_URL:
+        client = redis.from_url(REDIS_URL)
+
+
+async def close_cache():
+    """Close the Redis client"""
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
+
+
+async def get_activities():
+    """Return the cached activities JSON, or None on a miss"""
+    if client is not None:
+        try:
+            return await client.get(ACTIVITIES_KEY)
+        except RedisError:
+            return None
+
+    if _last_activities is not None:
+        stored_at, payload = _last_activities
+        if time.monotonic() - stored_at < ACTIVITIES_TTL:
+            return payload
+    return None
+
+
+async def get_stale_activities():
+    """Return the last known activities JSON, however old it is"""
+    if client is not None:
+        try:
+            payload = await client.get(STALE_ACTIVITIES_KEY)
+        except RedisError:
+            payload = None
+        if payload is not None:
+            return payload
+
+    if _last_activities is not None:
+        return _last_activities[1]
+    return None
+
+
+async def get_generation():
+    """Return a token to read before building the listing
+
+    Pass it to set_activities(); the listing is only stored if no
+    invalidation happened in between.
+    """
+    redis_generation = None
+    if client is not None:
+        try:
+            redis_generation = await client.get(GENERATION_KEY)
+        except RedisError:
+            # Without a generation to compare to, skip storing in Redis
+            return (_generation, False, None)
+    return (_generation, True, redis_generation)
+
+
+async def set_activities(payload, generation):
+    """Store freshly encoded activities JSON unless it is already outdated"""
+    global _last_activities
+    local_generation, redis_ok, redis_generation = generation
+    if local_generation != _generation:
+        return
+    _last_activities = (time.monotonic(), payload)
+
+    if client is not None and redis_ok:
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                # The transaction is aborted if another worker invalidates
+                # the listing between this check and the writes
+                await pipe.watch(GENERATION_KEY)
+                if await pipe.get(GENERATION_KEY) != redis_generation:
+                    return
+                pipe.multi()
+                pipe.set(ACTIVITIES_KEY, payload, ex=ACTIVITIES_TTL)
+                pipe.set(STALE_ACTIVITIES_KEY, payload, ex=STALE_ACTIVITIES_TTL)
+                await pipe.execute()
+        except RedisError:
+            # Includes WatchError when the listing was invalidated meanwhile
+            pass
+
+
+async def invalidate_activities():
+    """Drop the fresh activities listing after a change
+
+    The stale copy is kept so it can still be served if the next rebuild
+    fails.
+    """
+    global _last_activities, _generation
+    _generation += 1
+    if _last_activities is not None:
+        # Keep the payload for fallback but make it count as expired
+        _last_activities = (float("-inf"), _last_activities[1])
+
+    if client is not None:
+        try:
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.incr(GENERATION_KEY)
+                pipe.delete(ACTIVITIES_KEY)
+                await pipe.execute()
+        except RedisError:
+            pass
@@ -2,22 +2,62 @@
 Database configuration and models for the High School Management System
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Text, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, ForeignKey, Index
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import relationship
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base as async_declarative_base
 import os
 
 # Database URL - using SQLite for simplicity
 DATABASE_URL = "sqlite+aiosqlite:///./school_activities.db"
 
-# Create async engine
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+# Create async engine with a pool sized for concurrent requests, so that
+# connections (and the PRAGMAs set on them) are reused
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    future=True,
+    pool_size=20,
+    max_overflow=40
+)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite for concurrent reads and cheaper writes on each connection"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA mmap_size=134217728")
+    cursor.close()
+    # sqlite3 only emits BEGIN before DML, so SELECTs would run outside the
+    # transaction; take over transaction control (see "begin" below)
+    dbapi_connection.isolation_level = None
+
+
+@event.listens_for(engine.sync_engine, "begin")
+def begin_sqlite_transaction(conn):
+    """Start every transaction explicitly, IMMEDIATE for write sessions"""
+    mode = conn.get_execution_options().get("sqlite_begin")
+    conn.exec_driver_sql(f"BEGIN {mode}" if mode else "BEGIN")
+
+
+# Create async session; endpoints commit explicitly, so autoflush only adds
+# an identity map scan before every query
+async_session = async_sessionmaker(
+    engine, expire_on_commit=False, autoflush=False
+)
 
-# Create async session
-async_session = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
+# Sessions for endpoints that write take the write lock up front, so their
+# checks and writes cannot interleave with another writer's
+async_write_session = async_sessionmaker(
+    engine.execution_options(sqlite_begin="IMMEDIATE"),
+    expire_on_commit=False,
+    autoflush=False
 )
 
 Base = async_declarative_base()
@@ -27,22 +67,33 @@ class Activity(Base):
     """Activity model representing an extracurricular activity"""
     __tablename__ = "activities"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     name = Column(String(100), unique=True, nullable=False, index=True)
     description = Column(Text, nullable=False)
     schedule = Column(String(200), nullable=False)
     max_participants = Column(Integer, nullable=False)
 
     # Relationship to participants
-    participants = relationship("Participant", back_populates="activity", cascade="all, delete-orphan")
+    participants = relationship(
+        "Participant",
+        back_populates="activity",
+        cascade="all, delete-orphan",
+        order_by="Participant.id"
+    )
 
 
 class Participant(Base):
     """Participant model representing a student enrolled in an activity"""
     __tablename__ = "participants"
-
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String(100), nullable=False, index=True)
+    __table_args__ = (
+        # A student can only sign up once per activity; the backing index
+        # also serves lookups by activity_id and covers the participant
+        # listing and count queries
+        Index("uq_participant_activity_email", "activity_id", "email", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    email = Column(String(100), nullable=False)
     activity_id = Column(Integer, ForeignKey("activities.id"), nullable=False)
 
     # Relationship to activity
@@ -54,10 +105,42 @@ async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
 
+    # create_all skips tables that already exist, so make sure databases
+    # created before an index was added get it too
+    async with engine.begin() as conn:
+        try:
+            await conn.run_sync(create_missing_indexes)
+        except IntegrityError as exc:
+            raise RuntimeError(
+                "Cannot create the unique participant index: the database "
+                "already contains duplicate signups. Remove the duplicate "
+                "rows from 'participants' or delete school_activities.db."
+            ) from exc
+
+
+def create_missing_indexes(connection):
+    """Create any model index that is missing from an existing table"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
 
 async def get_session() -> AsyncSession:
-    """Dependency to get database session"""
-    async with async_session() as session:
+    """Dependency to get database session
+
+    Each request runs in a single transaction, committed when the request
+    finishes (or earlier by the endpoint) and rolled back on errors.
+    """
+    async with async_session.begin() as session:
+        yield session
+
+
+async def get_write_session() -> AsyncSession:
+    """Dependency to get database session for endpoints that write
+
+    Like get_session, but the transaction starts with BEGIN IMMEDIATE.
+    """
+    async with async_write_session.begin() as session:
         yield session
 
 
@@ -65,9 +148,11 @@ async def seed_initial_data():
     """Seed the database with initial activity data"""
     async with async_session() as session:
         # Check if data already exists
-        from sqlalchemy import select
-        result = await session.execute(select(Activity))
-        existing = result.scalars().first()
+        from sqlalchemy import select, insert, literal
+        result = await session.execute(
+            select(literal(1)).select_from(Activity).limit(1)
+        )
+        existing = result.first() is not None
         
         if existing:
             return  # Data already seeded
@@ -139,16 +224,25 @@ async def seed_initial_data():
             }
         ]
         
-        # Add activities and participants
-        for activity_data in initial_activities:
-            participants_list = activity_data.pop("participants")
-            activity = Activity(**activity_data)
-            session.add(activity)
-            await session.flush()  # Get the activity ID
-            
-            # Add participants
-            for email in participants_list:
-                participant = Participant(email=email, activity_id=activity.id)
-                session.add(participant)
+        # Insert all activities in one statement and get their IDs back
+        participants_by_name = {
+            activity_data["name"]: activity_data.pop("participants")
+            for activity_data in initial_activities
+        }
+        result = await session.execute(
+            insert(Activity).returning(Activity.id, Activity.name),
+            initial_activities
+        )
+        activity_ids = {name: activity_id for activity_id, name in result}
+        
+        # Insert all participants in one statement
+        await session.execute(
+            insert(Participant),
+            [
+                {"email": email, "activity_id": activity_ids[name]}
+                for name, emails in participants_by_name.items()
+                for email in emails
+            ]
+        )
         
         await session.commit()